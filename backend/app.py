@@ -1,10 +1,17 @@
 # backend/app.py
+import math
 import os
+import threading
 import time
-from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import lru_cache
 
+import numpy as np
+import orjson
 import requests
+from dogpile.cache import make_region
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from flask import (
     Flask,
@@ -15,6 +22,8 @@ from flask import (
     request,
     url_for,
 )
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 
 # ---- local modules (you already have these) ----
 # solar.solar_position(lat, lon, when_utc) -> (elevation_deg, azimuth_deg)
@@ -28,9 +37,86 @@ from energy_model import predict_kwh, annual_co2_savings
 load_dotenv()  # reads backend/.env
 OWM_KEY = os.getenv("WEATHER_API_KEY", "")  # OpenWeatherMap key
 AQI_KEY = os.getenv("AQI_API_KEY", "")      # World Air Quality Index token
+# (connect, read) seconds. Nothing is retried (see SESSION), so an unreachable
+# host costs ~1.5 s and a stalled response ~4 s per upstream call. DNS lookup
+# is not covered by requests timeouts: a slow resolver adds on top of this.
+HTTP_TIMEOUT = (1.5, 4.0)
+
+# Weather/AQI freshness window. STATE["_last_fetch"] and disk-cache entries are
+# both aged from the moment the upstream fetch started, so they expire together.
+WEATHER_TTL_S = 600
+
+# Upstream URLs with the key baked in; only lat/lon are filled per call
+OWM_URL_TMPL = (
+    "https://api.openweathermap.org/data/2.5/weather"
+    "?lat={}&lon={}&units=metric&appid=" + OWM_KEY
+)
+WAQI_URL_TMPL = "https://api.waqi.info/feed/geo:{};{}/?token=" + AQI_KEY
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (C encoder, NumPy-aware)."""
+
+    option = orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # skip the bytes -> str -> bytes round trip of the base implementation
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=self.option), mimetype="application/json"
+        )
+
 
 # Default Flask layout: looks in ./templates and ./static automatically
 app = Flask(__name__, template_folder="templates", static_folder="static")
+app.json = OrjsonProvider(app)
+
+# Compress JSON responses (mostly /api/series) above 1 KB; brotli first
+app.config["COMPRESS_MIN_SIZE"] = 1024
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+Compress(app)
+
+# One pooled HTTP session for OWM/WAQI: keep-alive reuses TCP+TLS connections
+# across refreshes instead of paying a fresh handshake on every call.
+SESSION = requests.Session()
+SESSION.headers["Connection"] = "keep-alive"
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        # no retries at all: each one would re-spend the full HTTP_TIMEOUT while
+        # holding an EXECUTOR worker; a failed fetch is retried by the next refresh
+        max_retries=0,
+    ),
+)
+
+# Disk-backed TTL cache for upstream responses: survives restarts and is
+# shared by sibling worker processes on the same host.
+API_CACHE = make_region().configure(
+    "dogpile.cache.dbm",
+    expiration_time=WEATHER_TTL_S,  # backstop; fetch_* enforce the TTL themselves
+    arguments={
+        "filename": os.path.join(os.path.dirname(__file__), ".weather_cache.dbm"),
+        # the default single lockfile serializes *all* keys, so OWM and WAQI
+        # could never fetch concurrently; per-key in-process locks instead
+        "dogpile_lockfile": False,
+    },
+)
+
+# Small worker pool so OWM and WAQI are fetched side by side.
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# Longest a request thread waits on a blocking refresh (forced, or no data
+# yet). The fetch keeps running on EXECUTOR and lands in STATE when done,
+# so a slow upstream costs a short wait instead of a parked WSGI worker.
+REFRESH_WAIT_S = 2.0
 
 
 # -------------------- in-memory state --------------------
@@ -48,22 +134,99 @@ STATE = {
     "weather_desc": None,
     "_last_fetch": 0,    # epoch seconds
 }
+STATE_LOCK = threading.RLock()  # guards every STATE read-modify-write
+
+# /api/config fields: key -> (type, min, max, out_of_range). Values are coerced
+# once on write, so everything reading STATE can trust the types. Out-of-range
+# numbers are clamped, wrapped (angles that go round) or rejected with 400.
+CONFIG_SCHEMA = {
+    "auto": (bool, None, None, None),
+    "lat": (float, -90.0, 90.0, "reject"),
+    "lon": (float, -180.0, 180.0, "wrap"),
+    "panel_kw": (float, 0.0, 100.0, "clamp"),
+    "cloud_pct": (int, 0, 100, "clamp"),
+    "aqi": (int, 0, 1000, "clamp"),
+    "tilt": (float, 0.0, 90.0, "clamp"),
+    "az": (float, 0.0, 360.0, "wrap"),
+}
 
-HISTORY = deque(maxlen=2000)  # tiny time-series buffer
+# Column layout of the HISTORY ring buffer (one NumPy array per field).
+HISTORY_COLS = (
+    ("ts", np.int64),           # epoch ms
+    ("elevation", np.float64),
+    ("azimuth", np.float64),
+    ("tilt", np.float64),
+    ("cloud_pct", np.int32),
+    ("aqi", np.int32),
+    ("power_w", np.float64),
+    ("energy_kwh", np.float64),
+)
+HISTORY_FIELDS = tuple(name for name, _ in HISTORY_COLS)
+
+
+class History:
+    """Tiny time-series ring buffer stored as struct-of-arrays.
+
+    Each field lives in its own fixed-size NumPy column; `head` is the next
+    slot to overwrite, so appends are O(1) and aggregates are vectorized.
+    """
+
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self.cols = {name: np.zeros(maxlen, dtype) for name, dtype in HISTORY_COLS}
+        self._columns = tuple(self.cols.values())  # HISTORY_FIELDS order
+        self.head = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def append(self, *values):
+        """Write one sample; values are positional in HISTORY_FIELDS order."""
+        if len(values) != len(self._columns):
+            raise ValueError(
+                f"expected {len(self._columns)} history fields, got {len(values)}"
+            )
+        with self._lock:
+            i = self.head
+            for col, value in zip(self._columns, values):
+                col[i] = value
+            self.head = (i + 1) % self.maxlen
+            self.count = min(self.count + 1, self.maxlen)
+
+    def snapshot(self):
+        """Return ({field: array oldest->newest}, total_kwh) as one consistent view."""
+        with self._lock:
+            if self.count < self.maxlen:
+                cols = {name: col[:self.count].copy() for name, col in self.cols.items()}
+            else:
+                cols = {name: np.roll(col, -self.head) for name, col in self.cols.items()}
+        return cols, float(cols["energy_kwh"].sum())
+
+
+HISTORY = History(maxlen=2000)
+
+_REFRESH_LOCK = threading.Lock()
+PENDING = {}  # (round(lat,2), round(lon,2)) -> Future of the in-flight refresh
+
+# /api/state serves pre-serialized bytes for up to a second, or until STATE changes
+_STATE_VERSION = 0   # bumped on every STATE write
+# (payload bytes, built_at epoch seconds, STATE version); always replaced whole
+_CACHED_STATE = (b"", 0.0, -1)
 
 
 # -------------------- helpers --------------------
-def fetch_weather(lat: float, lon: float):
+def _bump_state_version():
+    # caller holds STATE_LOCK
+    global _STATE_VERSION
+    _STATE_VERSION += 1
+
+
+def _fetch_weather(lat: float, lon: float):
     """Return weather dict or None."""
     if not OWM_KEY:
         return None
     try:
-        url = (
-            "https://api.openweathermap.org/data/2.5/weather"
-            f"?lat={lat}&lon={lon}&units=metric&appid={OWM_KEY}"
-        )
-        r = requests.get(url, timeout=6)
-        j = r.json()
+        r = SESSION.get(OWM_URL_TMPL.format(lat, lon), timeout=HTTP_TIMEOUT)
+        j = orjson.loads(r.content)
         return {
             "temp_c": j.get("main", {}).get("temp"),
             "humidity": j.get("main", {}).get("humidity"),
@@ -74,14 +237,13 @@ def fetch_weather(lat: float, lon: float):
         return None
 
 
-def fetch_aqi(lat: float, lon: float):
+def _fetch_aqi(lat: float, lon: float):
     """Return AQI int or None."""
     if not AQI_KEY:
         return None
     try:
-        url = f"https://api.waqi.info/feed/geo:{lat};{lon}/?token={AQI_KEY}"
-        r = requests.get(url, timeout=6)
-        j = r.json()
+        r = SESSION.get(WAQI_URL_TMPL.format(lat, lon), timeout=HTTP_TIMEOUT)
+        j = orjson.loads(r.content)
         if j.get("status") == "ok":
             return int(j.get("data", {}).get("aqi", 0))
         return None
@@ -89,40 +251,185 @@ def fetch_aqi(lat: float, lon: float):
         return None
 
 
-def refresh_weather_if_stale(force: bool = False):
-    """Refresh weather/AQI no more than every 10 minutes unless forced."""
-    now = time.time()
-    if not force and (now - STATE["_last_fetch"] < 600):
-        return
+def _cacheable(stamped):
+    # failures/missing keys come back as None; never pin those for 10 minutes
+    return stamped[1] is not None
+
+
+@API_CACHE.cache_on_arguments(should_cache_fn=_cacheable)
+def _cached_weather(lat: float, lon: float):
+    return time.time(), _fetch_weather(lat, lon)
+
+
+@API_CACHE.cache_on_arguments(should_cache_fn=_cacheable)
+def _cached_aqi(lat: float, lon: float):
+    return time.time(), _fetch_aqi(lat, lon)
+
+
+def _cached_fetch(cached_fn, lat, lon, fresh):
+    """(fetched_at, value) for the ~1 km grid cell around lat/lon.
+
+    An entry already older than WEATHER_TTL_S by its own fetched_at is
+    refetched, even if dogpile (which stamps it on completion) or an entry
+    written by another process would still hand it out.
+    """
+    cell = (round(lat, 2), round(lon, 2))
+    if not fresh:
+        fetched_at, value = cached_fn(*cell)
+        if time.time() - fetched_at < WEATHER_TTL_S:
+            return fetched_at, value
+    cached_fn.invalidate(*cell)
+    return cached_fn(*cell)
 
-    lat, lon = STATE["lat"], STATE["lon"]
 
-    w = fetch_weather(lat, lon)
-    if w:
-        if w.get("cloud_pct") is not None:
-            STATE["cloud_pct"] = int(w["cloud_pct"])
-        STATE["temp_c"] = w.get("temp_c")
-        STATE["humidity"] = w.get("humidity")
-        STATE["weather_desc"] = w.get("weather_desc")
+def fetch_weather(lat: float, lon: float, fresh: bool = False):
+    """Cached weather as (fetched_at, dict or None on failure)."""
+    return _cached_fetch(_cached_weather, lat, lon, fresh)
 
-    aqi_val = fetch_aqi(lat, lon)
-    if aqi_val is not None and aqi_val > 0:
-        STATE["aqi"] = aqi_val
 
-    STATE["_last_fetch"] = now
+def fetch_aqi(lat: float, lon: float, fresh: bool = False):
+    """Cached AQI as (fetched_at, int or None on failure)."""
+    return _cached_fetch(_cached_aqi, lat, lon, fresh)
+
+
+def _stamped_result(future, started):
+    # a fetch that raised counts as a failed attempt made when we started
+    return future.result() if future.exception() is None else (started, None)
+
+
+def _apply_refresh(lat, lon, w, aqi_val, fetched_at):
+    """Copy a finished weather/AQI fetch into STATE (if still for this location)."""
+    with STATE_LOCK:
+        if (round(STATE["lat"], 2), round(STATE["lon"], 2)) != (round(lat, 2), round(lon, 2)):
+            return  # location changed while we were fetching; drop the result
+
+        if w:
+            if w.get("cloud_pct") is not None:
+                STATE["cloud_pct"] = int(w["cloud_pct"])
+            STATE["temp_c"] = w.get("temp_c")
+            STATE["humidity"] = w.get("humidity")
+            STATE["weather_desc"] = w.get("weather_desc")
+
+        if aqi_val is not None and aqi_val > 0:
+            STATE["aqi"] = aqi_val
+
+        STATE["_last_fetch"] = fetched_at
+        _bump_state_version()
+
+
+def _start_refresh(lat, lon, fresh: bool = False):
+    """Return the Future of the weather/AQI refresh for this ~1 km cell.
+
+    Concurrent callers for the same rounded coordinates share a single
+    in-flight refresh instead of each hitting OWM/WAQI. fresh=True skips
+    the disk cache (only matters when no refresh is already running).
+    """
+    key = (round(lat, 2), round(lon, 2))
+    with _REFRESH_LOCK:
+        pending = PENDING.get(key)
+        if pending is not None:
+            return pending
+        pending = PENDING[key] = Future()
+
+    started = time.time()
+    remaining = [2]
+
+    def _one_done(_future):
+        # the second upstream call to land applies both results
+        with _REFRESH_LOCK:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            w_at, w = _stamped_result(f_weather, started)
+            aqi_at, aqi_val = _stamped_result(f_aqi, started)
+            # STATE is as old as the older of the two (possibly cached) values
+            _apply_refresh(lat, lon, w, aqi_val, min(w_at, aqi_at))
+        finally:
+            with _REFRESH_LOCK:
+                PENDING.pop(key, None)
+            pending.set_result(None)
+
+    # fire both upstream calls at once: wall time is max(owm, waqi), not the sum
+    f_weather = EXECUTOR.submit(fetch_weather, lat, lon, fresh)
+    f_aqi = EXECUTOR.submit(fetch_aqi, lat, lon, fresh)
+    f_weather.add_done_callback(_one_done)
+    f_aqi.add_done_callback(_one_done)
+    return pending
+
+
+def refresh_weather_if_stale(force: bool = False):
+    """Refresh weather/AQI no more than every 10 minutes unless forced.
+
+    Stale-while-revalidate: once the data is older than the TTL the current
+    STATE keeps being served and a background refresh is started.
+    Only a forced refresh, or having no data at all, blocks the caller,
+    and then for at most REFRESH_WAIT_S.
+
+    Returns True while a refresh is still in flight, i.e. STATE does not
+    reflect it yet (it lands on a later poll).
+    """
+    with STATE_LOCK:
+        last, lat, lon = STATE["_last_fetch"], STATE["lat"], STATE["lon"]
+    if not force and (time.time() - last < WEATHER_TTL_S):
+        return False
+
+    pending = _start_refresh(lat, lon, fresh=force)
+    if force or not last:
+        try:
+            pending.result(timeout=REFRESH_WAIT_S)
+        except TimeoutError:
+            pass  # keep serving what we have; the refresh lands when it lands
+    return not pending.done()
+
+
+@lru_cache(maxsize=1024)
+def _cached_solar(lat_q: float, lon_q: float, minute_epoch: int):
+    """solar_position at 1-minute granularity; the sun barely moves in a minute."""
+    return solar_position(
+        lat_q, lon_q, datetime.fromtimestamp(minute_epoch * 60, timezone.utc)
+    )
+
+
+def _coerce_config(key, value):
+    """Validate one /api/config value against CONFIG_SCHEMA (400 if unusable)."""
+    typ, lo, hi, out_of_range = CONFIG_SCHEMA[key]
+    if typ is bool:
+        if not isinstance(value, bool):
+            abort(400, description=f"{key} must be true/false")
+        return value
+    if isinstance(value, bool):  # float(True) would quietly store 1
+        abort(400, description=f"{key} must be a number")
+    try:
+        value = float(value)
+        if math.isnan(value):
+            raise ValueError(key)
+        if typ is int:
+            value = int(round(value))
+    except (TypeError, ValueError, OverflowError):
+        abort(400, description=f"{key} must be a number")
+
+    if lo <= value <= hi:
+        return value
+    if out_of_range == "wrap" and math.isfinite(value):
+        return (value - lo) % (hi - lo) + lo  # e.g. az -10 -> 350, lon 190 -> -170
+    if out_of_range == "clamp":
+        return min(hi, max(lo, value))
+    abort(400, description=f"{key} must be between {lo} and {hi}")
 
 
 def _push_history(el, az, tilt, kwh, cloud_pct, aqi):
-    HISTORY.append({
-        "ts": int(time.time() * 1000),
-        "elevation": round(el, 2),
-        "azimuth": round(az, 2),
-        "tilt": round(tilt, 2),
-        "cloud_pct": int(cloud_pct),
-        "aqi": int(aqi),
-        "power_w": max(0, kwh * 1000),    # toy instantaneous value
-        "energy_kwh": max(0, kwh / 60.0), # pretend this sample is 1 minute
-    })
+    # positional row in HISTORY_FIELDS order: no per-sample dict
+    HISTORY.append(
+        int(time.time() * 1000),  # ts
+        round(el, 2),
+        round(az, 2),
+        round(tilt, 2),
+        cloud_pct,
+        aqi,
+        max(0, kwh * 1000),       # power_w: toy instantaneous value
+        max(0, kwh / 60.0),       # energy_kwh: pretend this sample is 1 minute
+    )
 
 
 # -------------------- pages --------------------
@@ -142,71 +449,101 @@ def legacy():
 @app.get("/api/state")
 def api_state():
     """Current system state + computed targets + energy."""
+    global _CACHED_STATE
     refresh_weather_if_stale(force=False)
 
-    el, az = solar_position(STATE["lat"], STATE["lon"], datetime.now(timezone.utc))
+    now = time.time()
+    with STATE_LOCK:
+        s, version = STATE.copy(), _STATE_VERSION
+    cached_payload, cached_at, cached_version = _CACHED_STATE  # one read
+    if now - cached_at < 1.0 and version == cached_version:
+        return app.response_class(cached_payload, mimetype="application/json")
+
+    el, az = _cached_solar(round(s["lat"], 3), round(s["lon"], 3), int(now // 60))
 
     # pick target angles
-    target_tilt = el if STATE["auto"] else STATE["tilt"]
-    target_az = az if STATE["auto"] else STATE["az"]
+    target_tilt = el if s["auto"] else s["tilt"]
+    target_az = az if s["auto"] else s["az"]
 
     # daily energy estimate
     daily_kwh = predict_kwh(
-        STATE["panel_kw"], el, target_tilt, STATE["cloud_pct"], STATE["aqi"]
+        s["panel_kw"], el, target_tilt, s["cloud_pct"], s["aqi"]
     )
     annual_kwh = round(daily_kwh * 365.0, 1)
     co2_tonnes = annual_co2_savings(annual_kwh)
 
-    _push_history(el, az, target_tilt, daily_kwh, STATE["cloud_pct"], STATE["aqi"])
+    _push_history(el, az, target_tilt, daily_kwh, s["cloud_pct"], s["aqi"])
 
-    return jsonify({
-        "auto": STATE["auto"],
-        "lat": STATE["lat"],
-        "lon": STATE["lon"],
-        "now_utc": datetime.now(timezone.utc).isoformat(),
+    payload = orjson.dumps({
+        "auto": s["auto"],
+        "lat": s["lat"],
+        "lon": s["lon"],
+        "now_utc": datetime.fromtimestamp(now, timezone.utc).isoformat(timespec="seconds"),
         "solar": {"elevation": round(el, 2), "azimuth": round(az, 2)},
         "target": {"tilt": round(target_tilt, 2), "az": round(target_az, 2)},
-        "panel_kw": STATE["panel_kw"],
+        "panel_kw": s["panel_kw"],
         "weather": {
-            "cloud_pct": STATE["cloud_pct"],
-            "aqi": STATE["aqi"],
-            "temp_c": STATE["temp_c"],
-            "humidity": STATE["humidity"],
-            "desc": STATE["weather_desc"],
+            "cloud_pct": s["cloud_pct"],
+            "aqi": s["aqi"],
+            "temp_c": s["temp_c"],
+            "humidity": s["humidity"],
+            "desc": s["weather_desc"],
         },
         "energy": {
             "daily_kwh": daily_kwh,
             "annual_kwh": annual_kwh,
             "co2_tonnes": co2_tonnes,
         },
-    })
+    }, option=app.json.option)
+    with STATE_LOCK:
+        # a slow rebuild must not replace a payload built from newer STATE
+        _, cached_at, cached_version = _CACHED_STATE
+        if (version, now) > (cached_version, cached_at):
+            _CACHED_STATE = (payload, now, version)
+    return app.response_class(payload, mimetype="application/json")
 
 
 @app.post("/api/config")
 def api_config():
     """Update config values (auto/lat/lon/panel_kw/cloud_pct/aqi/tilt/az)."""
     data = request.get_json(silent=True) or {}
-    for key in ["auto", "lat", "lon", "panel_kw", "cloud_pct", "aqi", "tilt", "az"]:
-        if key in data and data[key] is not None:
-            STATE[key] = data[key]
-
-    # Weather might depend on new lat/lon
-    refresh_weather_if_stale(force=True)
-    return jsonify({"ok": True, "state": STATE})
+    if not isinstance(data, dict):
+        abort(400, description="expected a JSON object")
+    updates = {
+        key: _coerce_config(key, data[key])
+        for key in CONFIG_SCHEMA
+        if data.get(key) is not None
+    }
+    with STATE_LOCK:
+        old_loc = (STATE["lat"], STATE["lon"])
+        STATE.update(updates)
+
+        # Weather for a new lat/lon is missing, not just stale -> fetch it now
+        if (STATE["lat"], STATE["lon"]) != old_loc:
+            STATE["_last_fetch"] = 0
+        _bump_state_version()
+
+    pending = refresh_weather_if_stale()
+    with STATE_LOCK:
+        s = STATE.copy()
+    return jsonify({"ok": True, "pending": pending, "state": s})
 
 
 @app.route("/api/refresh_weather", methods=["POST", "GET"])
 def api_refresh_weather():
     """Force-refresh weather and AQI now."""
-    refresh_weather_if_stale(force=True)
+    pending = refresh_weather_if_stale(force=True)
+    with STATE_LOCK:
+        s = STATE.copy()
     return jsonify({
         "ok": True,
+        "pending": pending,  # True: upstream still answering, weather below is old
         "state": {
-            "cloud_pct": STATE["cloud_pct"],
-            "aqi": STATE["aqi"],
-            "temp_c": STATE["temp_c"],
-            "humidity": STATE["humidity"],
-            "desc": STATE["weather_desc"],
+            "cloud_pct": s["cloud_pct"],
+            "aqi": s["aqi"],
+            "temp_c": s["temp_c"],
+            "humidity": s["humidity"],
+            "desc": s["weather_desc"],
         },
     })
 
@@ -214,8 +551,9 @@ def api_refresh_weather():
 @app.get("/api/series")
 def api_series():
     """Return recent time-series samples (toy analytics)."""
-    pts = list(HISTORY)
-    total_kwh = sum(p["energy_kwh"] for p in pts)
+    cols, total_kwh = HISTORY.snapshot()
+    rows = zip(*(cols[name].tolist() for name in HISTORY_FIELDS))
+    pts = [dict(zip(HISTORY_FIELDS, row)) for row in rows]
     return jsonify({"ok": True, "total_kwh": round(total_kwh, 3), "points": pts})
 
 
@@ -2,23 +2,33 @@
 # Predict daily energy (kWh) from panel size, tilt match, weather, AQI.
 # Very simple & explainable model for judges.
 
-def clamp(x, lo, hi): return max(lo, min(hi, x))
+from jit import njit
+
+_INV_60 = 1.0/60.0
+_INV_100 = 1.0/100.0
+_INV_500 = 1.0/500.0
 
 def predict_kwh(panel_kw, elevation_deg, tilt_deg, cloud_pct=0, aqi=50, hours_sun=5.5):
+    # one float64 signature for the compiled core, rounding stays in Python
+    kwh = _predict_kwh_core(float(panel_kw), float(elevation_deg), float(tilt_deg),
+                            float(cloud_pct), float(aqi), float(hours_sun))
+    return round(kwh, 2)
+
+@njit(cache=True, fastmath=True)
+def _predict_kwh_core(panel_kw, elevation_deg, tilt_deg, cloud_pct, aqi, hours_sun):
     # Tilt penalty: difference from elevation hurts yield
     tilt_error = abs(elevation_deg - tilt_deg)
-    tilt_factor = clamp(1.0 - (tilt_error/60.0), 0.4, 1.0)  # up to -60° then 40%
+    tilt_factor = min(1.0, max(0.4, 1.0 - tilt_error*_INV_60))  # up to -60° then 40%
 
     # Clouds penalty (linear for demo)
-    cloud_factor = clamp(1.0 - cloud_pct/100.0, 0.2, 1.0)
+    cloud_factor = min(1.0, max(0.2, 1.0 - cloud_pct*_INV_100))
 
     # AQI penalty (good→bad reduces irradiance proxy)
-    # 50 → 1.0, 300+ → 0.6
-    aqi = clamp(aqi, 20, 400)
-    aqi_factor = clamp(1.0 - (aqi - 50)/500.0, 0.6, 1.0)
+    # 50 → 1.0, 250+ → 0.6 (the factor bounds make an AQI clamp redundant)
+    aqi_factor = min(1.0, max(0.6, 1.0 - (aqi - 50)*_INV_500))
 
     base = panel_kw * hours_sun  # simplistic daily capacity
-    return round(base * tilt_factor * cloud_factor * aqi_factor, 2)
+    return base * tilt_factor * cloud_factor * aqi_factor
 
 def annual_co2_savings(kwh_year, grid_emission_factor=0.7):
     # 0.7 kg CO2 per kWh (India average-type factor, tunable)
@@ -0,0 +1,12 @@
+# jit.py
+# Optional Numba: hot numeric kernels are compiled to native code when numba
+# is installed, and simply run as plain Python when it is not.
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        # supports both @njit and @njit(cache=True, ...)
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
@@ -1,16 +1,23 @@
 # solar.py
-from math import sin, cos, tan, asin, acos, atan2, radians, degrees
 from datetime import datetime, timezone
+from functools import lru_cache
+
+import numpy as np
+
+from jit import njit
 
 def _julian_day(dt_utc):
     # Meeus approximation
     y = dt_utc.year; m = dt_utc.month; D = dt_utc.day
     H = dt_utc.hour + dt_utc.minute/60 + dt_utc.second/3600
-    if m <= 2:
-        y -= 1; m += 12
+    # Jan/Feb count as months 13/14 of the previous year (branchless)
+    m_le2 = int(m <= 2)
+    y -= m_le2; m += 12*m_le2
     A = y // 100
     B = 2 - A + (A // 4)
-    jd = int(365.25*(y + 4716)) + int(30.6001*(m + 1)) + D + B - 1524.5 + H/24
+    # integer forms of int(365.25*(y+4716)) and int(30.6001*(m+1))
+    Y = y + 4716
+    jd = 365*Y + Y//4 + (306001*(m + 1))//10000 + D + B - 1524.5 + H/24
     return jd
 
 def solar_position(lat_deg, lon_deg, dt_utc=None):
@@ -19,43 +26,83 @@ def solar_position(lat_deg, lon_deg, dt_utc=None):
     if dt_utc is None:
         dt_utc = datetime.now(timezone.utc)
 
-    jd = _julian_day(dt_utc)
-    n = jd - 2451545.0  # days since J2000.0
+    # datetime handling stays in Python; the trig runs in the compiled cores
+    n = _julian_day(dt_utc) - 2451545.0  # days since J2000.0
+    alpha, delta, GMST = _solar_time_terms(round(n*86400))
+    return _solar_site_core(float(lat_deg), float(lon_deg), alpha, delta, GMST)
 
+@lru_cache(maxsize=64)
+def _solar_time_terms(sec_j2000):
+    """Time-only terms, shared by every site at the same UTC second."""
+    return _solar_time_core(sec_j2000/86400)
+
+# The cores use NumPy ufuncs so one implementation serves both paths:
+# numba compiles them for float64 scalars (solar_position) and for arrays
+# (solar_position_batch); without numba NumPy evaluates them either way.
+@njit(cache=True, fastmath=True)
+def _solar_time_core(n):
+    """(alpha, delta, GMST) in degrees for n days since J2000.0."""
     # Mean longitude, anomaly (deg)
     L = (280.460 + 0.9856474*n) % 360
     g = (357.528 + 0.9856003*n) % 360
-    g_rad = radians(g)
+    g_rad = np.radians(g)
 
     # Ecliptic longitude (deg)
-    lam = L + 1.915*sin(g_rad) + 0.020*sin(2*g_rad)
+    lam = L + 1.915*np.sin(g_rad) + 0.020*np.sin(2*g_rad)
 
     # Obliquity (deg)
     eps = 23.439 - 0.0000004*n
 
     # Right ascension/declination
-    lam_rad = radians(lam)
-    eps_rad = radians(eps)
-    alpha = degrees(atan2(cos(eps_rad)*sin(lam_rad), cos(lam_rad)))
-    delta = degrees(asin(sin(eps_rad)*sin(lam_rad)))
+    lam_rad = np.radians(lam)
+    eps_rad = np.radians(eps)
+    alpha = np.degrees(np.arctan2(np.cos(eps_rad)*np.sin(lam_rad), np.cos(lam_rad)))
+    delta = np.degrees(np.arcsin(np.sin(eps_rad)*np.sin(lam_rad)))
 
     # Sidereal time (deg)
     GMST = (280.46061837 + 360.98564736629*n) % 360
+    return alpha, delta, GMST
+
+@njit(cache=True, fastmath=True)
+def _solar_site_core(lat_deg, lon_deg, alpha, delta, GMST):
+    """(elevation, azimuth) in degrees from the time terms for one site."""
     LST = (GMST + lon_deg) % 360
 
     # Hour angle
     H = (LST - alpha + 540) % 360 - 180  # wrap to [-180,180]
-    lat = radians(lat_deg)
-    Hrad = radians(H)
-    deltar = radians(delta)
+    lat = np.radians(lat_deg)
+    Hrad = np.radians(H)
+    deltar = np.radians(delta)
 
     # Elevation
-    sin_el = sin(lat)*sin(deltar) + cos(lat)*cos(deltar)*cos(Hrad)
-    el = degrees(asin(sin_el))
+    sin_el = np.sin(lat)*np.sin(deltar) + np.cos(lat)*np.cos(deltar)*np.cos(Hrad)
+    el = np.degrees(np.arcsin(sin_el))
 
     # Azimuth (from North, clockwise)
-    y = -sin(Hrad)*cos(deltar)
-    x = cos(lat)*sin(deltar) - sin(lat)*cos(deltar)*cos(Hrad)
-    az = (degrees(atan2(y, x)) + 360) % 360
+    y = -np.sin(Hrad)*np.cos(deltar)
+    x = np.cos(lat)*np.sin(deltar) - np.sin(lat)*np.cos(deltar)*np.cos(Hrad)
+    az = (np.degrees(np.arctan2(y, x)) + 360) % 360
 
     return el, az
+
+_J2000 = np.datetime64("2000-01-01T12:00:00", "ms")
+
+def _naive_utc(dt):
+    # numpy datetime64 has no timezones: shift aware datetimes to UTC and drop tzinfo
+    if isinstance(dt, datetime) and dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def solar_position_batch(lat_deg, lon_deg, dt_utc):
+    """Vectorized solar_position for many timestamps at once.
+       dt_utc: datetime64 array, or datetimes (aware, or naive = UTC).
+       Returns (elevation_deg, azimuth_deg) as ndarrays."""
+    if isinstance(dt_utc, np.ndarray) and dt_utc.dtype.kind == "M":
+        t = dt_utc.astype("datetime64[ms]")
+    else:
+        t = np.array([_naive_utc(dt) for dt in dt_utc], dtype="datetime64[ms]")
+    n = (t - _J2000) / np.timedelta64(1, "D")  # days since J2000.0
+
+    # same compiled cores as the scalar path, just fed arrays
+    alpha, delta, GMST = _solar_time_core(n)
+    return _solar_site_core(float(lat_deg), float(lon_deg), alpha, delta, GMST)